@@ -1,7 +1,56 @@
 import os
 import json
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+import atexit
+import glob
+import gzip
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, abort, request, jsonify, send_file
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No flock() (Windows): file_lock only excludes threads of this process
+
+# --- JSON: orjson when available (faster, emits bytes), stdlib json otherwise ---
+def _json_dumps_line(obj):
+    return (json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+try:
+    import orjson
+
+    # orjson only handles 64-bit integers: it reads wider ones as lossy floats and refuses to encode them.
+    # Any run of 19+ digits might be such an integer, so those documents go through stdlib json instead.
+    _LONG_DIGITS = re.compile(rb"\d{19,}")
+
+    def dumps_line(obj):
+        try:
+            return orjson.dumps(obj) + b"\n"
+        except orjson.JSONEncodeError:
+            return _json_dumps_line(obj)
+
+    def decode_line(data):
+        # Returns the parsed document and the encoder that writes it back unchanged
+        if not _LONG_DIGITS.search(data):
+            try:
+                return orjson.loads(data), dumps_line
+            except orjson.JSONDecodeError:
+                pass  # Possibly NaN/Infinity (e.g. TradingView templates), which only stdlib json accepts
+        # stdlib json keeps what orjson would alter: wide integers exact, NaN/Infinity as written
+        return json.loads(data), _json_dumps_line
+except ImportError:
+    dumps_line = _json_dumps_line
+
+    def decode_line(data):
+        return json.loads(data), _json_dumps_line
+
+def loads(data):
+    return decode_line(data)[0]
 
 app = Flask(__name__)
 
@@ -14,75 +63,459 @@ WEBHOOKS = [
 
 DOWNLOAD_SECRET = "my_download_secret_9876"  # Change to a strong secret
 
+PURGE_INTERVAL_S = 3600  # Each LogWriter purges its logfile at most once per interval
+
+# Buffered log writes: flush every BATCH_MS or as soon as BATCH_SIZE lines queue up
+BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", 100))
+BATCH_MS = int(os.environ.get("WEBHOOK_BATCH_MS", 50))
+QUEUE_MAX = int(os.environ.get("WEBHOOK_QUEUE_MAX", 10000))  # Pending lines before POSTs get 503
+IOV_MAX = 1024  # Buffers per writev() call (Linux/BSD limit)
+
+# Durable mode: fdatasync once per flush (group commit) and answer POSTs only after their line is synced
+FSYNC = os.environ.get("WEBHOOK_FSYNC", "0") == "1"
+FSYNC_TIMEOUT_S = 5
+_fdatasync = getattr(os, "fdatasync", os.fsync)
+
+def _writev(fd, buffers):
+    if hasattr(os, "writev"):
+        return os.writev(fd, buffers)
+    return os.write(fd, b"".join(buffers))  # No writev() (Windows): one joined write
+
+# Rotation: once the live logfile passes ROTATE_BYTES it is renamed and gzipped in the background
+ROTATE_BYTES = int(os.environ.get("WEBHOOK_ROTATE_BYTES", 10 * 1024 * 1024))
+
+# --- Helper: Parse stored timestamps (naive UTC) ---
+LEGACY_TIMESTAMP_FORMATS = ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%SZ")
+
+def parse_timestamp(ts_str):
+    # Fast path: everything this app writes is datetime.isoformat(), which fromisoformat parses in C
+    try:
+        ts = datetime.fromisoformat(ts_str)
+    except ValueError:
+        for fmt in LEGACY_TIMESTAMP_FORMATS:
+            try:
+                return datetime.strptime(ts_str, fmt)
+            except ValueError:
+                continue
+        raise
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+# --- Helper: Durable renames (FSYNC mode): sync file contents before, and the directory entry after ---
+def fsync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def fsync_dir(path):
+    fsync_file(os.path.dirname(os.path.abspath(path)))
+
 # --- Helper: Purge log entries older than 7 days ---
+def is_recent_entry(line, cutoff):
+    try:
+        entry = loads(line)
+        ts_str = entry.get("timestamp")
+        if not ts_str:
+            return True  # Keep if no timestamp found
+        return parse_timestamp(ts_str) > cutoff
+    except Exception:
+        return False
+
 def purge_old_entries(logfile):
+    # Same window as the old per-entry (now - ts).days <= 7: anything younger than 8 days is kept
+    cutoff = datetime.utcnow() - timedelta(days=8)
+    # An archive's mtime is when it was rotated out, i.e. the time of its newest entry
+    cutoff_epoch = cutoff.replace(tzinfo=timezone.utc).timestamp()
+    for archive in list_archives(logfile):
+        if os.path.getmtime(archive) < cutoff_epoch:
+            os.remove(archive)
     if not os.path.exists(logfile):
         return
-    now = datetime.utcnow()
-    new_logs = []
-    with open(logfile, "r") as f:
-        for line in f:
+    with open(logfile, "rb") as f:
+        # Lines are appended in time order: drop the expired head, keep everything from the first recent entry
+        dropped = False
+        while True:
+            line = f.readline()
+            if not line or is_recent_entry(line, cutoff):
+                break
+            dropped = True
+        if not dropped:
+            return  # Oldest entry is still recent: nothing to rewrite
+        # Private temp file per purge so concurrent purges (other threads or workers) never share one
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(logfile)),
+                                        prefix=os.path.basename(logfile) + ".purge-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(line)
+                shutil.copyfileobj(f, out)
+                if FSYNC:
+                    out.flush()
+                    os.fsync(out.fileno())
+            shutil.copymode(logfile, tmp_file)
+            # Atomic swap: readers keep a complete old or new file, never a half-written one
+            os.replace(tmp_file, logfile)
+            if FSYNC:
+                fsync_dir(logfile)
+        except BaseException:
+            try:
+                os.remove(tmp_file)
+            except FileNotFoundError:
+                pass
+            raise
+
+# --- Helper: Rotated archives (<logfile>.<UTC stamp>, gzipped to .gz once compressed) ---
+_compress_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="LogCompress")
+
+def list_archives(logfile):
+    # Oldest first; a raw archive is skipped once its .gz twin exists
+    archives = []
+    for path in sorted(glob.glob(glob.escape(logfile) + ".2*")):
+        if path.endswith(".tmp") or (not path.endswith(".gz") and os.path.exists(path + ".gz")):
+            continue
+        archives.append(path)
+    return archives
+
+def open_log(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+def open_logs(logfile):
+    # Archives oldest first, then the live logfile
+    files = []
+    for path in list_archives(logfile) + [logfile]:
+        try:
+            files.append(open_log(path))
+        except FileNotFoundError:
+            if os.path.exists(path + ".gz"):  # Compressed since it was listed
+                files.append(open_log(path + ".gz"))
+    return files
+
+def compress_archive(path, writer):
+    tmp_file = path + ".gz.tmp"
+    try:
+        with open(path, "rb") as src, gzip.open(tmp_file, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        if FSYNC:
+            fsync_file(tmp_file)
+    except FileNotFoundError:
+        return  # Archive was cleared or purged while queued
+    # Publish under file_lock so a clear or purge running meanwhile can't have its deleted data come back
+    with writer.file_lock:
+        if not os.path.exists(path):
+            try:
+                os.remove(tmp_file)
+            except FileNotFoundError:
+                pass
+            return
+        os.replace(tmp_file, path + ".gz")
+        if FSYNC:
+            fsync_dir(path)  # The .gz must be durable before the raw archive goes away
+        os.remove(path)
+
+# --- File lock: excludes other threads and other worker processes sharing the logfile ---
+class FileLock:
+    def __init__(self, logfile):
+        self._lock = threading.Lock()
+        # flock() locks belong to the open file description, so every process (forked children included)
+        # must open <logfile>.lock itself
+        self._fd = os.open(logfile + ".lock", os.O_RDWR | os.O_CREAT, 0o644) if fcntl else None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._fd is not None:
             try:
-                entry = json.loads(line)
-                ts_str = entry.get("timestamp")
-                if ts_str:
-                    try:
-                        ts = datetime.fromisoformat(ts_str)
-                    except ValueError:
-                        ts = datetime.strptime(ts_str, "%Y-%m-%dT%H:%M:%S")
-                else:
-                    ts = now  # Keep if no timestamp found
-                if (now - ts).days <= 7:
-                    new_logs.append(entry)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+# --- Write ticket: lets a durable-mode POST wait for the flush carrying its line and learn its outcome ---
+class WriteTicket(threading.Event):
+    ok = False
+
+    def resolve(self, ok):
+        self.ok = ok
+        self.set()
+
+# --- Buffered writer: queues lines and appends them from a background thread ---
+class LogWriter:
+    def __init__(self, logfile):
+        self.logfile = logfile
+        self._fd = self._open()
+        self._last_purge = None  # time.monotonic() of the last purge; None purges on the first tick
+        self._start()
+
+    def _start(self):
+        # Also called in forked children: the parent's thread is gone and its locks may be held
+        if getattr(self, "file_lock", None) is not None:
+            self.file_lock.close()  # Inherited lock fd shares the parent's flock; open our own
+        self.file_lock = FileLock(self.logfile)  # Hold while reading/rewriting the logfile
+        self._buffer = deque()
+        self._event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"LogWriter-{self.logfile}", daemon=True)
+        self._thread.start()
+
+    def append(self, line):
+        # Lock-free: deque.append is atomic, so request threads never contend with each other or the flush.
+        # Returns None when the writer is (roughly) QUEUE_MAX lines behind so callers can shed load,
+        # otherwise a WriteTicket resolved by the flush carrying this line (FSYNC mode) or True
+        if len(self._buffer) >= QUEUE_MAX:
+            return None
+        ticket = WriteTicket() if FSYNC else None
+        self._buffer.append((line, ticket))
+        # FSYNC mode wakes the writer at once: POSTs arriving during its fdatasync form the next group.
+        # Otherwise one wakeup per full batch; later appends ride along until the writer drains
+        if (FSYNC or len(self._buffer) >= BATCH_SIZE) and not self._event.is_set():
+            self._event.set()
+        return ticket or True
+
+    def flush(self):
+        if not self._buffer:
+            return  # Idle tick: skip the flock round trip. Lines appended meanwhile are picked up next tick
+        # Drain under file_lock so concurrent flushes keep lines in order
+        with self.file_lock:
+            popleft = self._buffer.popleft
+            items = [popleft() for _ in range(len(self._buffer))]
+            if not items:
+                return
+            lines = [line for line, _ in items]
+            try:
+                try:
+                    self._reopen_if_moved()
+                    self._write(lines)
+                except OSError:
+                    # Fd went stale (e.g. logfile rotated or removed): reopen and retry once.
+                    # _write consumed what already reached the file, so only the rest is written again
+                    self._reopen()
+                    self._write(lines)
+            except BaseException:
+                # Put whatever didn't reach the file back at the front of the queue for the next flush
+                unwritten = len(lines)
+                written, requeued = items[:len(items) - unwritten], items[len(items) - unwritten:]
+                self._buffer.extendleft(reversed([(bytes(line), ticket) for line, (_, ticket) in zip(lines, requeued)]))
+                self._resolve(written, False)  # On disk but never synced: can't be confirmed as durable
+                raise
+            if FSYNC:
+                try:
+                    _fdatasync(self._fd)  # Group commit: one sync covers every line in this flush
+                except BaseException:
+                    self._resolve(items, False)
+                    raise
+            self._resolve(items, True)
+            if os.fstat(self._fd).st_size >= ROTATE_BYTES:
+                self._rotate()
+
+    @staticmethod
+    def _resolve(items, ok):
+        for _, ticket in items:
+            if ticket is not None:
+                ticket.resolve(ok)
+
+    def close(self):
+        self.flush()
+        with self.file_lock:
+            os.close(self._fd)
+
+    def _open(self):
+        # O_APPEND: every write() lands atomically at the current end, even with other worker processes appending
+        return os.open(self.logfile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _write(self, pending):
+        # writev() hands the queued lines to the kernel without joining them first.
+        # Written bytes are removed from the front of `pending`, so after an error it holds exactly the unwritten rest
+        while pending:
+            batch = pending[:IOV_MAX]
+            written = _writev(self._fd, batch)
+            done = 0
+            while done < len(batch) and written >= len(batch[done]):
+                written -= len(batch[done])
+                done += 1
+            del pending[:done]
+            if written:
+                pending[0] = memoryview(pending[0])[written:]  # Partially written line
+
+    def _reopen(self):
+        old_fd, self._fd = self._fd, self._open()
+        try:
+            os.close(old_fd)
+        except OSError:
+            pass
+
+    def _rotate(self):
+        archive = f"{self.logfile}.{datetime.utcnow():%Y%m%dT%H%M%S%f}"
+        os.rename(self.logfile, archive)
+        # Swap in the new fd before closing the old one: self._fd must never name a closed (reusable) fd
+        old_fd, self._fd = self._fd, self._open()
+        os.close(old_fd)
+        if FSYNC:
+            fsync_dir(self.logfile)  # Persist the rename and the new logfile's entry
+        try:
+            _compress_pool.submit(compress_archive, archive, self)
+        except RuntimeError:
+            # Pool already shut down (interpreter exit): leave the archive uncompressed, GET still reads it
+            pass
+
+    def _reopen_if_moved(self):
+        # The logfile path now points at a different file (or none): stop writing to the old one
+        try:
+            moved = os.stat(self.logfile).st_ino != os.fstat(self._fd).st_ino
+        except FileNotFoundError:
+            moved = True
+        if moved:
+            self._reopen()
+
+    def _run(self):
+        while True:
+            self._event.wait(timeout=BATCH_MS / 1000)
+            self._event.clear()
+            try:
+                self.flush()
             except Exception:
-                continue
-    with open(logfile, "w") as f:
-        for entry in new_logs:
-            f.write(json.dumps(entry) + "\n")
-
-# --- Dynamic endpoints creation ---
-for webhook_name in WEBHOOKS:
-    log_file = f"{webhook_name}_logs.json"
-
-    def make_post_handler(logfile):
-        def handler():
-            data = request.get_json(force=True)
-            # Attach standardized UTC ISO timestamp
-            data["timestamp"] = datetime.utcnow().isoformat()
-            purge_old_entries(logfile)
-            with open(logfile, "a") as f:
-                f.write(json.dumps(data) + "\n")
-            return "", 200
-        return handler
-
-    def make_get_handler(logfile):
-        def handler():
-            # Security: Require ?token=DOWNLOAD_SECRET
-            token = request.args.get("token", None)
-            if token != DOWNLOAD_SECRET:
-                return jsonify({"error": "Unauthorized"}), 401
-            purge_old_entries(logfile)
-            if not os.path.exists(logfile):
-                return jsonify([]), 200
-            with open(logfile, "r") as f:
-                lines = f.readlines()
-            logs = [json.loads(line) for line in lines if line.strip()]
-            return jsonify(logs), 200
-        return handler
-
-    def make_clear_handler(logfile):
-        def handler():
-            # Security: Require ?token=DOWNLOAD_SECRET
-            token = request.args.get("token", None)
-            if token != DOWNLOAD_SECRET:
-                return jsonify({"error": "Unauthorized"}), 401
-            open(logfile, "w").close()
-            return jsonify({"status": f"{logfile} cleared"}), 200
-        return handler
-
-    app.add_url_rule(f"/{webhook_name}", f"post_{webhook_name}", make_post_handler(log_file), methods=["POST"])
-    app.add_url_rule(f"/{webhook_name}/logs", f"getlogs_{webhook_name}", make_get_handler(log_file), methods=["GET"])
-    app.add_url_rule(f"/{webhook_name}/clearlogs", f"clearlogs_{webhook_name}", make_clear_handler(log_file), methods=["POST"])
+                app.logger.exception("Failed to flush %s", self.logfile)
+            self._maybe_purge()
+
+    def _maybe_purge(self):
+        # Purge at most once per PURGE_INTERVAL_S, from this thread only, so requests never wait on the rewrite
+        now = time.monotonic()
+        if self._last_purge is not None and now - self._last_purge <= PURGE_INTERVAL_S:
+            return
+        self._last_purge = now
+        try:
+            with self.file_lock:
+                purge_old_entries(self.logfile)  # Queued lines land in the new file via _reopen_if_moved
+        except Exception:
+            # Purging is housekeeping: a failure is logged and retried next interval
+            app.logger.exception("Failed to purge %s", self.logfile)
+
+_writers = {}
+
+# --- Helper: Stream archives + live logfile back to back as one NDJSON body ---
+STREAM_CHUNK_BYTES = 64 * 1024
+
+def stream_ndjson(files):
+    for f in files:
+        with f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK_BYTES), b""):
+                yield chunk
+
+class SnapshotReader:
+    # Caps an open logfile at the size seen under file_lock, so later appends never outgrow Content-Length
+    def __init__(self, f, size):
+        self._f = f
+        self._left = size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._left:
+            size = self._left
+        data = self._f.read(size) if size else b""
+        self._left -= len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
+@atexit.register
+def _close_all_writers():
+    for writer in _writers.values():
+        try:
+            writer.close()
+        except Exception:
+            app.logger.exception("Failed to close %s", writer.logfile)
+    _compress_pool.shutdown(wait=True)
+
+# --- Restart background threads in forked workers (e.g. gunicorn --preload) ---
+def _restart_threads_after_fork():
+    global _compress_pool
+    _compress_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="LogCompress")
+    for writer in _writers.values():
+        writer._start()  # Lines still queued in the parent are flushed by the parent
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_threads_after_fork)
+
+# --- Endpoints: one shared handler per route, dispatched on the webhook name ---
+LOGFILES = {name: f"{name}_logs.json" for name in WEBHOOKS}
+for log_file in LOGFILES.values():
+    _writers[log_file] = LogWriter(log_file)
+
+def logfile_for(webhook):
+    logfile = LOGFILES.get(webhook)
+    if logfile is None:
+        abort(404)
+    return logfile
+
+@app.route("/<webhook>", methods=["POST"])
+def post_webhook(webhook):
+    logfile = logfile_for(webhook)
+    try:
+        data, encode_line = decode_line(request.get_data())
+    except ValueError:
+        return jsonify({"error": "Invalid JSON"}), 400
+    # Attach standardized UTC ISO timestamp
+    data["timestamp"] = datetime.utcnow().isoformat()
+    ticket = _writers[logfile].append(encode_line(data))
+    if ticket is None:
+        return jsonify({"error": "Log queue full, retry later"}), 503
+    if FSYNC:
+        if not ticket.wait(FSYNC_TIMEOUT_S):
+            # Still queued (failed flushes requeue it), so it will be written: 202, not a retryable error
+            return jsonify({"status": "Accepted, not yet durable"}), 202
+        if not ticket.ok:
+            return jsonify({"error": "Log write failed"}), 500
+    return "", 200
+
+@app.route("/<webhook>/logs", methods=["GET"])
+def get_logs(webhook):
+    logfile = logfile_for(webhook)
+    # Security: Require ?token=DOWNLOAD_SECRET
+    token = request.args.get("token", None)
+    if token != DOWNLOAD_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+    writer = _writers[logfile]
+    writer.flush()
+    with writer.file_lock:
+        if list_archives(logfile) or not os.path.exists(logfile):
+            files = open_logs(logfile)
+        else:
+            # Single plain file: open and size it under the lock, then serve exactly that snapshot
+            f = open(logfile, "rb")
+            st = os.fstat(f.fileno())
+            files = None
+    if files is not None:
+        return Response(stream_ndjson(files), mimetype="application/x-ndjson"), 200
+    response = send_file(SnapshotReader(f, st.st_size), mimetype="application/x-ndjson",
+                         etag=f"{st.st_ino}-{st.st_size}-{st.st_mtime_ns}", last_modified=st.st_mtime)
+    response.content_length = st.st_size
+    # Conditional/Range handling against the snapshot size (send_file can't size a file object itself)
+    return response.make_conditional(request, accept_ranges=True, complete_length=st.st_size)
+
+@app.route("/<webhook>/clearlogs", methods=["POST"])
+def clear_logs(webhook):
+    logfile = logfile_for(webhook)
+    # Security: Require ?token=DOWNLOAD_SECRET
+    token = request.args.get("token", None)
+    if token != DOWNLOAD_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+    writer = _writers[logfile]
+    writer.flush()
+    with writer.file_lock:
+        open(logfile, "w").close()
+        for archive in list_archives(logfile) + glob.glob(glob.escape(logfile) + ".2*.gz.tmp"):
+            os.remove(archive)
+    return jsonify({"status": f"{logfile} cleared"}), 200
 
 @app.route("/", methods=["GET"])
 def home():
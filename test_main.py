@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# main opens its logfiles and starts writer threads at import, so each scenario runs in a fresh
+# interpreter inside its own temp dir
+PRELUDE = f"""
+import errno, os, sys, time
+sys.path.insert(0, {HERE!r})
+import main
+w = main._writers["webhook1_logs.json"]
+"""
+
+def run(tmp_path, script, **env):
+    # Writer thread parked by default so the scenario drives every flush itself
+    env = {**os.environ, "WEBHOOK_BATCH_MS": "100000", "WEBHOOK_BATCH_SIZE": "100000", **env}
+    result = subprocess.run([sys.executable, "-c", PRELUDE + textwrap.dedent(script)], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split()
+
+def logged(tmp_path):
+    return (tmp_path / "webhook1_logs.json").read_bytes().splitlines()
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+def test_no_lines_lost_while_another_worker_purges(tmp_path):
+    # Regression: worker B's lines went to the inode worker A's purge had just replaced (26 of 1500 lost)
+    out = run(tmp_path, """
+        OLD = b'{"timestamp":"2020-01-01T00:00:00"}\\n'
+        pid = os.fork()
+        if pid == 0:
+            c = main.app.test_client()
+            ok = sum(c.post("/webhook1", json={"b": i}).status_code == 200 for i in range(1500))
+            w.flush()
+            print(ok)
+            os._exit(0)
+        for _ in range(300):
+            with w.file_lock:
+                with open("webhook1_logs.json", "rb") as f:
+                    data = f.read()
+                with open("head.tmp", "wb") as f:
+                    f.write(OLD + data)
+                os.replace("head.tmp", "webhook1_logs.json")
+            w._last_purge = None
+            w._maybe_purge()
+        os.waitpid(pid, 0)
+    """, WEBHOOK_BATCH_MS="1", WEBHOOK_BATCH_SIZE="10")
+    assert out == ["1500"]
+    lines = [line for line in logged(tmp_path) if b'"b"' in line]
+    assert len(lines) == len(set(lines)) == 1500
+
+def test_failed_flush_requeues_lines_in_order(tmp_path):
+    out = run(tmp_path, """
+        for i in range(10):
+            w.append(b'{"i":%d}\\n' % i)
+        real = os.writev
+        def broken(fd, buffers):
+            raise OSError(errno.EIO, "I/O error")
+        os.writev = broken
+        try:
+            w.flush()
+        except OSError:
+            pass
+        os.writev = real
+        print(len(w._buffer))
+        w.append(b'{"i":10}\\n')
+        w.flush()
+    """)
+    assert out == ["10"]
+    assert logged(tmp_path) == [b'{"i":%d}' % i for i in range(11)]
+
+def test_retry_after_partial_write_does_not_duplicate(tmp_path):
+    out = run(tmp_path, """
+        for i in range(1500):
+            w.append(b'{"i":%d}\\n' % i)
+        real, calls = os.writev, []
+        def flaky(fd, buffers):
+            calls.append(None)
+            if len(calls) == 2:
+                raise OSError(errno.ENOSPC, "No space left on device")
+            return real(fd, buffers)
+        os.writev = flaky
+        try:
+            w.flush()
+        except OSError:
+            pass
+        os.writev = real
+        w.flush()
+        print(len(w._buffer))
+    """)
+    assert out == ["0"]
+    assert logged(tmp_path) == [b'{"i":%d}' % i for i in range(1500)]
+
+def test_idle_flush_skips_file_lock(tmp_path):
+    out = run(tmp_path, """
+        class Forbidden:
+            def __enter__(self):
+                raise AssertionError("idle flush took file_lock")
+        w.flush()
+        w.file_lock, lock = Forbidden(), w.file_lock
+        w.flush()
+        w.file_lock = lock
+        print("ok")
+    """)
+    assert out == ["ok"]